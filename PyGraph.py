@@ -22,12 +22,24 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307
 # USA
 
+import os
 import math
+import zlib
+import struct
+import multiprocessing
+import cairo
 import utils
 
 
 class DotGraph():
 
+    # Los atributos que cambian el aspecto de la gráfica
+    options = ['background', 'border', 'draw_frame', 'frame_width',
+               'frame_color', 'draw_axes', 'draw_rows', 'draw_marks',
+               'draw_marks_labels', 'axes_marks', 'axes_width', 'axes_color',
+               'axes_labels_sizes', 'dots_radius', 'graph_line_width',
+               'simplify_tolerance']
+
     def __init__(self, context=None, data={},
                  colors={}, width=500, height=500):
 
@@ -60,6 +72,8 @@ class DotGraph():
         """
 
         self.context = context
+        self.dirty_all = True
+        self.dirty_regions = []
         self.set_data(data)
         self.set_colors(colors)
         self.set_width(width)
@@ -79,6 +93,10 @@ class DotGraph():
         self.axes_labels_sizes = 15
         self.dots_radius = 5
         self.graph_line_width = 2
+        self.simplify_tolerance = 0
+        self.fixed_range = None
+        self.text_cache = {}
+        self.labels_cache = {}
 
     def set_context(self, context):
         """
@@ -96,16 +114,196 @@ class DotGraph():
         data:
             Un diccionario, con los nombres de los datos a graficar
             como keys, y una lista con los valores a graficar.
+            Los valores también pueden ser un shared.SharedSeries, para
+            leerlos directamente de la memoria compartida con otro proceso.
         """
 
         if type(data) == dict:
             self.data = data
+            self.invalidate()
         else:
             return TypeError('"data" must be a dict')
 
     def get_data(self):
         return self.data
 
+    def set_value(self, name, index, value):
+        """
+        Cambia un valor de la serie name, marcando como modificada solo la
+        zona de la gráfica que ocupan los segmentos que tocan ese valor.
+        """
+
+        values = self.data[name]
+        old_value = values[index]
+        values[index] = value
+
+        if self.dirty_all:
+            return
+
+        if self.fixed_range is None:
+            if old_value == self.max_v_label and \
+                    utils.get_max([value]) < old_value:
+                maximum = self.get_max_value()
+            else:
+                maximum = utils.get_max([self.max_v_label, value])
+
+            if self.changes_scale(maximum):
+                self.invalidate()
+                return
+
+            self.max_v_label = maximum
+
+        index = index % len(values)
+        first = max(index - 1, 0)
+        last = min(index + 1, len(values) - 1)
+        self.add_dirty_area(first, last, [old_value] + values[first:last + 1])
+
+    def append_value(self, name, value, keep=None):
+        """
+        Agrega un valor al final de la serie name.
+
+        keep:
+            Un entero, si se indica se descartan los primeros valores de la
+            serie para que no tenga más de keep valores (la gráfica se
+            desplaza hacia la izquierda).
+        """
+
+        values = self.data[name]
+        values.append(value)
+        removed = []
+        if keep is not None and len(values) > keep:
+            removed = values[:len(values) - keep]
+            del values[:len(values) - keep]
+
+        if self.dirty_all:
+            return
+
+        if self.fixed_range is None:
+            if self.max_v_label in removed:
+                maximum = self.get_max_value()
+            else:
+                maximum = utils.get_max([self.max_v_label, value])
+
+            if len(values) > self.max_h_label or \
+                    self.changes_scale(maximum):
+                self.invalidate()
+                return
+
+            self.max_v_label = maximum
+
+        if removed:
+            # Se desplazó toda la serie
+            self.add_dirty_area(0, len(values) - 1, [0, self.v_top])
+        else:
+            first = max(len(values) - 2, 0)
+            self.add_dirty_area(first, len(values) - 1, values[first:])
+
+    def get_max_value(self):
+        # El mayor valor de todas las series
+        return max([utils.get_max(values) for values in self.data.values()]
+                   or [0])
+
+    def changes_scale(self, max_v_label):
+        # Indica si con ese valor máximo cambiarían las marcas del eje
+        # vertical (y con ellas la escala y el lugar de las etiquetas)
+        values = utils.get_nice_ticks(max_v_label, self.axes_marks)[0]
+        return values != [value for value, label, width in self.v_labels]
+
+    def add_dirty_area(self, first, last, values):
+        # Marcar como modificada la zona entre los índices first y last,
+        # que abarca verticalmente a todos los valores de values
+        values = [value for value in values if value is not None] or [0]
+        margin = self.dots_radius + self.graph_line_width
+        offset = self.dots_radius / 2.0
+        x1 = self.start_x + self.h_step * first - offset - margin
+        x2 = self.start_x + self.h_step * last - offset + margin
+        y1 = self.start_y - self.v_step * max(values) - offset - margin
+        y2 = self.start_y - self.v_step * min(values) - offset + margin
+
+        x1, y1 = int(math.floor(x1)), int(math.floor(y1))
+        x2, y2 = int(math.ceil(x2)), int(math.ceil(y2))
+        self.dirty_regions.append((x1, y1, x2 - x1, y2 - y1))
+
+        if len(self.dirty_regions) > 16:
+            # Demasiadas zonas pequeñas, se juntan en una sola
+            x1 = min([x for x, y, w, h in self.dirty_regions])
+            y1 = min([y for x, y, w, h in self.dirty_regions])
+            x2 = max([x + w for x, y, w, h in self.dirty_regions])
+            y2 = max([y + h for x, y, w, h in self.dirty_regions])
+            self.dirty_regions = [(x1, y1, x2 - x1, y2 - y1)]
+
+    def invalidate(self):
+        # Marcar toda la gráfica para volver a dibujarla
+        self.dirty_all = True
+        self.dirty_regions = []
+
+    def clear_caches(self):
+        """
+        Olvida las medidas de los textos y las etiquetas de los ejes. Los
+        cambios de fuente se detectan solos, salvo con fuentes que no son
+        cairo.ToyFontFace (por ejemplo las de Pango), en ese caso hay que
+        llamarlo después de cambiarla.
+        """
+
+        self.text_cache.clear()
+        self.labels_cache.clear()
+        self.invalidate()
+
+    def get_dirty_regions(self):
+        """
+        Devuelve una lista de rectángulos (x, y, width, height) con las
+        zonas que cambiaron desde el último render, para usar con
+        GtkWidget.queue_draw_area:
+
+        for region in graph.get_dirty_regions():
+            area.queue_draw_area(*region)
+
+        Al dibujar solo esas zonas (con el clip que da GTK) render_graph
+        únicamente dibuja los segmentos que las tocan. Los cambios hechos
+        sin usar los métodos de DotGraph no se detectan, en ese caso hay que
+        llamar a invalidate.
+        """
+
+        if self.dirty_all:
+            return [(0, 0, int(math.ceil(self.width)),
+                     int(math.ceil(self.height)))]
+
+        return list(self.dirty_regions)
+
+    def load_rollups(self, rollups, start, end, field='mean'):
+        """
+        Carga los datos desde rollup.Rollup, eligiendo la resolución más
+        fina que tenga como mucho un valor por píxel del ancho de la
+        gráfica. Todas las series usan los mismos intervalos y tienen el
+        mismo largo; las que no tienen datos en el rango se omiten. Los
+        intervalos sin datos quedan como None y no se dibujan.
+
+        rollups:
+            Un diccionario con los nombres de los datos como keys, y un
+            rollup.Rollup como values.
+
+        start, end:
+            El rango de tiempo a graficar, en segundos.
+
+        field:
+            'mean', 'min', 'max' o 'count'.
+        """
+
+        points = max(int(self.width), 2)
+
+        # Todas las series usan los mismos intervalos, para que cada índice
+        # corresponda al mismo momento
+        resolution = max([rollup.get_level(start, end, points).resolution
+                          for rollup in rollups.values()] or [1])
+
+        data = {}
+        for name, rollup in rollups.items():
+            values = rollup.get_values(start, end, points, field, resolution)
+            if values:
+                data[name] = values
+
+        self.set_data(data)
+
     def set_colors(self, colors):
         """
         colors:
@@ -121,6 +319,7 @@ class DotGraph():
                 colors[name] = utils.get_cairo_color(colors[name])
 
             self.colors = colors
+            self.invalidate()
         else:
             return TypeError('"colors" must be a dict')
 
@@ -136,6 +335,7 @@ class DotGraph():
 
         if type(width) in [float, int]:
             self.width = width
+            self.invalidate()
         else:
             raise TypeError('"width" must be a int or float')
 
@@ -154,6 +354,7 @@ class DotGraph():
 
         if type(height) in [float, int]:
             self.height = height
+            self.invalidate()
         else:
             raise TypeError('"height" must be a int or float')
 
@@ -171,6 +372,7 @@ class DotGraph():
 
         if type(background) in [list, tuple, str]:
             self.background = utils.get_cairo_color(background)
+            self.invalidate()
         else:
             raise TypeError(
                 '"background" must be a list, a tuple, or a string')
@@ -186,6 +388,7 @@ class DotGraph():
 
         if type(border) in [int, float]:
             self.border = border
+            self.invalidate()
         else:
             raise TypeError('"border" must be a int or float')
 
@@ -200,6 +403,7 @@ class DotGraph():
 
         if type(draw_frame) == bool:
             self.draw_frame = draw_frame
+            self.invalidate()
         else:
             raise TypeError('"draw_frame" must be a bool')
 
@@ -214,6 +418,7 @@ class DotGraph():
 
         if type(frame_width) in [int, float]:
             self.frame_width = frame_width
+            self.invalidate()
         else:
             raise TypeError('"frame_width" must be a int or float')
 
@@ -229,6 +434,7 @@ class DotGraph():
 
         if type(frame_color) in [list, tuple, str]:
             self.frame_color = utils.get_cairo_color(frame_color)
+            self.invalidate()
         else:
             raise TypeError(
                 '"background" must be a list, a tuple, or a string')
@@ -244,6 +450,7 @@ class DotGraph():
 
         if type(draw_axes) == bool:
             self.draw_axes = draw_axes
+            self.invalidate()
         else:
             raise TypeError('"draw_axes" must be a bool')
 
@@ -258,6 +465,7 @@ class DotGraph():
 
         if type(draw_rows) == bool:
             self.draw_rows = draw_rows
+            self.invalidate()
         else:
             raise TypeError('"draw_rows" must be a bool')
 
@@ -272,6 +480,7 @@ class DotGraph():
 
         if type(draw_marks) == bool:
             self.draw_marks = draw_marks
+            self.invalidate()
         else:
             raise TypeError('"draw_marks" must be a bool')
 
@@ -287,25 +496,29 @@ class DotGraph():
 
         if type(draw_marks_labels) == bool:
             self.draw_marks_labels = draw_marks_labels
+            self.invalidate()
         else:
             raise TypeError('"draw_marks_labels" must be a bool')
 
     def get_draw_marks_labels(self):
         return self.draw_marks_labels
 
-    def set_number_of_axes_marks(self, axis_marks):
+    def set_number_of_axes_marks(self, axes_marks):
         """
-        axis_marks:
-            Un entero, la cantidad de marcas en los ejes
+        axes_marks:
+            Un entero, la cantidad aproximada de marcas en los ejes (se
+            eligen valores redondos, así que puede haber alguna más o
+            alguna menos)
         """
 
-        if type(axis_marks) == int:
-            self.axis_marks = axis_marks
+        if type(axes_marks) == int:
+            self.axes_marks = axes_marks
+            self.invalidate()
         else:
-            raise TypeError('"axis_marks" must be a int')
+            raise TypeError('"axes_marks" must be a int')
 
     def get_number_of_axes_marks(self):
-        return self.axis_marks
+        return self.axes_marks
 
     def set_axes_width(self, axes_width):
         """
@@ -315,6 +528,7 @@ class DotGraph():
 
         if type(axes_width) in [int, float]:
             self.axes_width = axes_width
+            self.invalidate()
         else:
             raise TypeError('"axes_width" must be a number')
 
@@ -329,6 +543,7 @@ class DotGraph():
 
         if type(axes_color) in [list, tuple, str]:
             self.axes_color = utils.get_cairo_color(axes_color)
+            self.invalidate()
         else:
             raise TypeError('"axes_color" must be a list, a tuple or a str')
 
@@ -343,10 +558,14 @@ class DotGraph():
         """
 
         if type(axes_labels_sizes) == int:
-            self.axes_color = utils.get_cairo_color(axes_labels_sizes)
+            self.axes_labels_sizes = axes_labels_sizes
+            self.invalidate()
         else:
             raise TypeError('"axes_labels_sizes" must be a int')
 
+    def get_axes_labels_sizes(self):
+        return self.axes_labels_sizes
+
     def set_dots_radius(self, dots_radius):
         """
         dots_radius:
@@ -355,6 +574,7 @@ class DotGraph():
 
         if type(dots_radius) in [int, float]:
             self.dots_radius = dots_radius
+            self.invalidate()
         else:
             raise TypeError('"dots_radius" must be a number')
 
@@ -370,64 +590,252 @@ class DotGraph():
 
         if type(graph_line_width) in [int, float]:
             self.graph_line_width = graph_line_width
+            self.invalidate()
         else:
             raise TypeError('"graph_line_width" must be a number')
 
     def get_graph_line_width(self):
         return self.graph_line_width
 
+    def set_range(self, max_h_label=None, max_v_label=None):
+        """
+        max_h_label, max_v_label:
+            La cantidad de valores del eje horizontal y el valor máximo del
+            eje vertical. Sirve para que varias gráficas usen los mismos
+            ejes; sin argumentos se vuelven a calcular a partir de los datos.
+        """
+
+        if max_h_label is None and max_v_label is None:
+            self.fixed_range = None
+        elif type(max_h_label) == int and type(max_v_label) in [int, float]:
+            self.fixed_range = (max_h_label, max_v_label)
+        else:
+            raise TypeError(
+                '"max_h_label" must be a int and "max_v_label" a number')
+
+        self.invalidate()
+
+    def get_range(self):
+        return self.fixed_range
+
+    def set_simplify_tolerance(self, simplify_tolerance):
+        """
+        simplify_tolerance:
+            Un entero o decimal, la distancia máxima (en unidades del
+            dispositivo) que se permite que una línea simplificada se aleje
+            de los puntos originales. Con 0 se dibuja cada segmento y cada
+            punto por separado; con un valor mayor cada serie se dibuja
+            como un solo trazo simplificado, y se omiten los puntos que
+            están a menos de esa distancia de otro punto ya dibujado.
+        """
+
+        if type(simplify_tolerance) in [int, float]:
+            self.simplify_tolerance = simplify_tolerance
+            self.invalidate()
+        else:
+            raise TypeError('"simplify_tolerance" must be a number')
+
+    def get_simplify_tolerance(self):
+        return self.simplify_tolerance
+
+    def export(self, filename, simplify_tolerance=0.5):
+        """
+        Exporta la gráfica a un archivo vectorial, el formato se elige
+        según la extensión de filename: .svg, .pdf, .ps o .eps
+
+        simplify_tolerance:
+            La tolerancia usada para simplificar las series mientras se
+            exporta, ver set_simplify_tolerance.
+        """
+
+        extension = os.path.splitext(filename)[1].lower()
+        if extension == '.svg':
+            surface = cairo.SVGSurface(filename, self.width, self.height)
+        elif extension == '.pdf':
+            surface = cairo.PDFSurface(filename, self.width, self.height)
+        elif extension in ['.ps', '.eps']:
+            surface = cairo.PSSurface(filename, self.width, self.height)
+            surface.set_eps(extension == '.eps')
+        else:
+            raise ValueError('Unknown vector format: "%s"' % extension)
+
+        context = self.context
+        tolerance = self.simplify_tolerance
+        dirty = self.dirty_all, self.dirty_regions
+        self.context = cairo.Context(surface)
+        self.simplify_tolerance = simplify_tolerance
+
+        try:
+            self.render()
+        except Exception:
+            # No dejar un archivo a medio escribir
+            surface.finish()
+            os.remove(filename)
+            raise
+        finally:
+            self.context = context
+            self.simplify_tolerance = tolerance
+            self.dirty_all, self.dirty_regions = dirty
+
+        surface.finish()
+
     def render(self):
         if self.data and self.context:
-            self.calculate_things()
-            self.render_background()
-            if self.draw_frame:
-                self.render_frame()
-            if self.draw_axes:
-                self.render_axes()
-            self.render_graph()
+            # Con series en memoria compartida (shared.SharedSeries) se
+            # vuelve a dibujar si el productor las cambió a mitad del render
+            for attempt in range(3):
+                self.pin_data()
+                self.calculate_things()
+                self.draw()
+                if not self.is_data_torn():
+                    break
+
+            self.dirty_all = False
+            self.dirty_regions = []
+
+    def pin_data(self):
+        for values in self.data.values():
+            if hasattr(values, 'pin'):
+                values.pin()
+
+    def is_data_torn(self):
+        for values in self.data.values():
+            if hasattr(values, 'is_torn') and values.is_torn():
+                return True
+
+        return False
+
+    def draw(self):
+        # Dibujar usando las medidas ya calculadas por calculate_things
+        self.render_background()
+        if self.draw_frame:
+            self.render_frame()
+        if self.draw_axes:
+            self.render_axes()
+        self.render_graph()
+
+    def render_tiled(self, filename, tile_size=1024, processes=None,
+                     compression=6):
+        """
+        Dibuja la gráfica en un archivo PNG, en partes de tile_size x
+        tile_size píxeles que se dibujan en paralelo en processes procesos
+        (por defecto uno por núcleo). Cada parte solo dibuja los puntos que
+        caen dentro de ella, y el archivo se va escribiendo a medida que se
+        completa cada fila de partes, por lo que nunca se tiene en memoria
+        la imagen entera. Sin datos se escribe una imagen con solo el
+        fondo.
+
+        compression:
+            Un entero del 0 al 9, el nivel de compresión del PNG.
+        """
+
+        width = int(math.ceil(self.width))
+        height = int(math.ceil(self.height))
+
+        # Las series en memoria compartida se copian, de nuevo si el
+        # productor las cambió mientras se copiaban
+        shared = self.data
+        for attempt in range(3):
+            self.pin_data()
+            data = dict([(name, list(values) if hasattr(values, 'pin')
+                          else values)
+                         for name, values in shared.items()])
+            if not self.is_data_torn():
+                break
+
+        # Las medidas se calculan una sola vez y se comparten con todas
+        # las partes
+        context = self.context
+        self.context = cairo.Context(
+            cairo.ImageSurface(cairo.FORMAT_RGB24, 1, 1))
+        self.data = data
+
+        try:
+            if self.data:
+                self.calculate_things()
+        finally:
+            self.context = context
+            self.data = shared
+
+        state = dict(self.__dict__)
+        state['context'] = None
+        state['data'] = data
+
+        bands = []
+        for y in range(0, height, tile_size):
+            band_height = min(tile_size, height - y)
+            bands.append([(x, y, min(tile_size, width - x), band_height)
+                          for x in range(0, width, tile_size)])
+
+        pool = multiprocessing.Pool(
+            processes, initializer=init_tile_worker, initargs=(state,))
+
+        try:
+            with open(filename, 'wb') as output:
+                output.write(b'\x89PNG\r\n\x1a\n')
+                output.write(utils.png_chunk(b'IHDR', struct.pack(
+                    '>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+
+                compressor = zlib.compressobj(compression)
+                pending = pool.map_async(render_tile, bands[0])
+
+                for index in range(len(bands)):
+                    tiles = pending.get()
+                    if index + 1 < len(bands):
+                        pending = pool.map_async(
+                            render_tile, bands[index + 1])
+
+                    for row in range(bands[index][0][3]):
+                        line = [b'\x00']
+                        for (x, y, w, h), tile in zip(bands[index], tiles):
+                            line.append(tile[row * w * 3:(row + 1) * w * 3])
+
+                        data = compressor.compress(b''.join(line))
+                        if data:
+                            output.write(utils.png_chunk(b'IDAT', data))
+
+                output.write(utils.png_chunk(b'IDAT', compressor.flush()))
+                output.write(utils.png_chunk(b'IEND', b''))
+        finally:
+            pool.terminate()
+            pool.join()
 
     def calculate_things(self):
         self.space_for_references = 0
         self.max_h_label = 0
         self.max_v_label = 0
-        self.widest_v_label = ''
         self.start_x = 0
         self.start_y = self.height
         self.marks_sizes = 10
-        self.max_v_label_size = 0
-
-        for name, values in self.data.items():
-            if self.max_h_label < len(values):
-                self.max_h_label = len(values)
-
-            if self.max_v_label < max(values):
-                self.max_v_label = max(values)
-
-            if self.space_for_references < self.context.text_extents(name)[2]:
-                self.space_for_references = self.context.text_extents(name)[2]
+        self.context.set_font_size(self.axes_labels_sizes)
 
-        for x in range(1, 7):
-            if len(str(self.max_v_label * 1.0 / x)) < self.widest_v_label:
-                self.widest_v_label = str(self.max_v_label * 1.0 / x)
+        if self.fixed_range:
+            self.max_h_label, self.max_v_label = self.fixed_range
 
-                if '.' in self.widest_v_label and \
-                        len(self.widest_v_label.split('.')[1]) > 2:
+        for name, values in self.data.items():
+            if self.fixed_range is None:
+                if self.max_h_label < len(values):
+                    self.max_h_label = len(values)
 
-                    self.widest_v_label = self.widest_v_label.split('.')[0] + \
-                        '.' + self.widest_v_label.split('.')[1][:2]
+                self.max_v_label = max(self.max_v_label,
+                                       utils.get_max(values))
 
-                if self.max_v_label_size < self.context.text_extents(
-                        self.widest_v_label)[2]:
+            width = utils.get_text_extents(
+                self.context, name, self.text_cache)[2]
+            if self.space_for_references < width:
+                self.space_for_references = width
 
-                    self.max_v_label_size = self.context.text_extents(
-                        self.widest_v_label)[2]
+        self.h_labels, self.v_labels = self.get_axes_labels()
+        self.v_top = self.v_labels[-1][0]
+        self.max_v_label_size = max([width for value, label, width in
+                                     self.v_labels])
 
         self.space_for_references += 50 if \
             self.space_for_references else 0  # The color box
         self.start_x += self.border
         self.start_x += self.axes_width if self.draw_axes else 0
         self.start_x += self.marks_sizes if self.draw_marks_labels else 0
-        self.start_x += len(self.widest_v_label) * self.axes_labels_sizes \
+        self.start_x += self.max_v_label_size \
             if self.draw_marks_labels else 0
         self.start_y -= self.border
         self.start_y -= self.axes_width if self.draw_axes else 0
@@ -445,15 +853,51 @@ class DotGraph():
         self.h_end = self.width - self.start_x
         self.v_start = self.start_y - self.axes_width / 2
         self.v_end = self.height - self.start_y  # top
-        self.h_distance = (self.h_end - self.h_start) / float(self.axes_marks)
-        self.v_distance = (self.v_start - self.v_end) / float(self.axes_marks)
-        self.h_step = (self.h_end - self.h_start) / float(self.max_h_label - 1)
-        self.v_step = (self.v_start - self.v_end) / float(self.max_v_label)
+        self.h_step = (self.h_end - self.h_start) / float(
+            max(self.max_h_label - 1, 1))
+        self.v_step = (self.v_start - self.v_end) / float(self.v_top)
 
         for name in self.data.keys():
             if name not in self.colors.keys():
                 self.colors[name] = utils.get_random_color()
 
+    def get_axes_labels(self):
+        # Las marcas de los ejes, como listas de (valor, texto, ancho del
+        # texto). Solo dependen del rango de los ejes y de la fuente, así
+        # que se calculan una vez y se guardan en self.labels_cache.
+        key = (self.max_h_label, self.max_v_label, self.axes_marks,
+               utils.get_font_key(self.context))
+
+        if key not in self.labels_cache:
+            if len(self.labels_cache) > 64:
+                self.labels_cache.clear()
+
+            h_values, h_precision = utils.get_nice_ticks(
+                self.max_h_label - 1, self.axes_marks, integer=True)
+            v_values, v_precision = utils.get_nice_ticks(
+                self.max_v_label, self.axes_marks)
+
+            h_labels = []
+            for value in h_values:
+                if value > max(self.max_h_label - 1, 1):
+                    break
+
+                label = utils.format_number(value, h_precision)
+                width = utils.get_text_extents(
+                    self.context, label, self.text_cache)[2]
+                h_labels.append((value, label, width))
+
+            v_labels = []
+            for value in v_values:
+                label = utils.format_number(value, v_precision)
+                width = utils.get_text_extents(
+                    self.context, label, self.text_cache)[2]
+                v_labels.append((value, label, width))
+
+            self.labels_cache[key] = (h_labels, v_labels)
+
+        return self.labels_cache[key]
+
     def render_background(self):
         self.context.set_source_rgb(*self.background)
         self.context.rectangle(0, 0, self.width, self.height)
@@ -504,81 +948,151 @@ class DotGraph():
 
             self.context.stroke()
 
-        if self.draw_marks and self.data:
-            for x in range(1, self.axes_marks + 1):
-                hx = self.h_distance * x + self.h_start
-                vx = self.start_x + 5 - self.axes_width / 2
-                hy = self.height - self.v_end - 5 - self.axes_width / 2
-                vy = self.v_start - self.v_distance * x
+        vx = self.start_x + 5 - self.axes_width / 2
+        hy = self.height - self.v_end - 5 - self.axes_width / 2
+        offset = self.dots_radius / 2.0
 
-                if x != self.axes_marks or not self.draw_rows:
+        if self.draw_marks and self.data:
+            for value, label, width in self.h_labels:
+                hx = self.start_x + self.h_step * value - offset
+                if value != self.max_h_label - 1 or not self.draw_rows:
                     self.context.move_to(hx, hy)
                     self.context.line_to(hx, hy + 10)
+
+            for value, label, width in self.v_labels:
+                vy = self.start_y - self.v_step * value - offset
+                if value != self.v_top or not self.draw_rows:
                     self.context.move_to(vx - 10, vy)
                     self.context.line_to(vx, vy)
 
-        if self.draw_marks_labels:
-            for x in range(1, self.axes_marks + 1):
-                hx = self.h_distance * x + self.h_start
-                vx = self.start_x + 5 - self.axes_width / 2
-                hy = self.height - self.v_end - 5 - self.axes_width / 2
-                vy = self.v_start - self.v_distance * x
-
-                h_value = (self.max_h_label / float(self.axes_marks)) * x
-                v_value = (self.max_v_label / float(
-                    self.axes_marks)) * (self.axes_marks - x + 1)
-                h_label = str(h_value)
-                v_label = str(v_value)
-
-                if '.' in h_label and len(h_label.split('.')[1]) > 2:
-                    h_label = h_label.split('.')[0] + '.' + \
-                        h_label.split('.')[1][:2]
-
-                if '.' in v_label and len(v_label.split('.')[1]) > 2:
-                    v_label = v_label.split('.')[0] + '.' + \
-                        v_label.split('.')[1][:2]
+            self.context.stroke()
 
+        if self.draw_marks_labels:
+            for value, label, width in self.h_labels:
+                hx = self.start_x + self.h_step * value - offset
                 self.context.move_to(
-                    hx - (self.axes_labels_sizes + 10) / 2.0,
+                    hx - width / 2.0,
                     hy + self.axes_width / 2 + (self.axes_labels_sizes + 10))
-                self.context.show_text(h_label)
+                self.context.show_text(label)
 
+            for value, label, width in self.v_labels:
+                vy = self.start_y - self.v_step * value - offset
                 self.context.move_to(
-                    vx - len(v_label) * self.axes_labels_sizes,
-                    self.v_start - self.v_distance * (
-                        self.axes_marks - x + 1) + self.axes_labels_sizes / 2)
-                self.context.show_text(v_label)
-
-            self.context.stroke()
+                    vx - self.marks_sizes - width - 5,
+                    vy + self.axes_labels_sizes / 2.0)
+                self.context.show_text(label)
 
     def render_graph(self):
+        if self.simplify_tolerance > 0:
+            self.render_simplified_graph()
+            return
+
+        first, last, top, bottom = self.get_visible_range()
+        self.context.set_line_width(self.graph_line_width)
+
         for name, values in self.data.items():
             x0, y0 = 0, 0
             draw_lines = False
+            self.context.set_source_rgb(*self.colors[name])
+
+            for index in range(first, min(last, len(values))):
+                if values[index] is None:
+                    # Un intervalo sin datos corta la línea
+                    draw_lines = False
+                    continue
 
-            for index in range(0, len(values)):
                 x = self.start_x + self.h_step * index - \
                     self.dots_radius / 2.0
                 y = self.start_y - self.v_step * values[index] - \
                     self.dots_radius / 2.0
 
-                self.context.set_source_rgb(*self.colors[name])
-
                 if draw_lines:
-                    self.context.set_line_width(self.graph_line_width)
-                    self.context.move_to(x0, y0)
-                    self.context.line_to(x, y)
-                    self.context.stroke()
+                    if (y0 >= top or y >= top) and \
+                            (y0 <= bottom or y <= bottom):
+                        self.context.move_to(x0, y0)
+                        self.context.line_to(x, y)
+                        self.context.stroke()
                 else:
                     draw_lines = True
 
-                self.context.arc(x, y, self.dots_radius, 0, 2 * math.pi)
-                self.context.fill()
+                if top <= y <= bottom:
+                    self.context.arc(x, y, self.dots_radius, 0, 2 * math.pi)
+                    self.context.fill()
+
                 x0, y0 = x, y
 
+    def get_visible_range(self):
+        # Los índices de los valores y los límites verticales de la zona
+        # visible del context (su clip), para no dibujar lo que no se ve.
+        x1, y1, x2, y2 = self.context.clip_extents()
+        margin = self.dots_radius + self.graph_line_width
+
+        if self.h_step > 0:
+            first = int(math.floor(
+                (x1 - margin - self.start_x) / self.h_step)) - 1
+            last = int(math.ceil(
+                (x2 + margin - self.start_x) / self.h_step)) + 2
+            first = max(first, 0)
+            last = max(last, first)
+        else:
+            first, last = 0, self.max_h_label
+
+        return first, last, y1 - margin, y2 + margin
+
+    def render_simplified_graph(self):
+        # Cada serie se dibuja como un solo trazo y un solo relleno, así
+        # las salidas vectoriales crecen con la complejidad visual y no con
+        # la cantidad de datos.
+        tolerance = math.hypot(*self.context.device_to_user_distance(
+            self.simplify_tolerance, 0))
+
+        first, last = self.get_visible_range()[:2]
+        self.context.set_line_width(self.graph_line_width)
+
+        for name, values in self.data.items():
+            # Los intervalos sin datos (None) cortan la línea en tramos
+            lines = [[]]
+            for index in range(first, min(last, len(values))):
+                if values[index] is None:
+                    if lines[-1]:
+                        lines.append([])
+                    continue
+
+                lines[-1].append((
+                    self.start_x + self.h_step * index -
+                    self.dots_radius / 2.0,
+                    self.start_y - self.v_step * values[index] -
+                    self.dots_radius / 2.0))
+
+            points = [point for line in lines for point in line]
+            if not points:
+                continue
+
+            self.context.set_source_rgb(*self.colors[name])
+
+            for line in lines:
+                if not line:
+                    continue
+
+                path = utils.simplify_path(line, tolerance)
+                self.context.move_to(*path[0])
+                for x, y in path[1:]:
+                    self.context.line_to(x, y)
+            self.context.stroke()
+
+            # Los marcadores a menos de la tolerancia de otro no se notan
+            for x, y in utils.visible_dots(points, tolerance):
+                self.context.move_to(x + self.dots_radius, y)
+                self.context.arc(x, y, self.dots_radius, 0, 2 * math.pi)
+            self.context.fill()
+
 
 class PieGraph():
 
+    # Los atributos que cambian el aspecto de la gráfica
+    options = ['background', 'radius', 'start_angle', 'inner_radius',
+               'line_color', 'line_width', 'font_size']
+
     width = 0
     height = 0
     line_width = 0
@@ -592,11 +1106,13 @@ class PieGraph():
         self.set_width(width)
         self.set_height(height)
         self.set_radius(radius if radius != 0 else min([width, height]) / 2.0)
+        self.background = (1, 1, 1)
         self.start_angle = 0
         self.inner_radius = 0
         self.line_color = (0.0, 0.0, 0.0)
         self.line_width = 2
         self.font_size = 15
+        self.text_cache = {}
 
     def set_context(self, context):
         """
@@ -770,8 +1286,10 @@ class PieGraph():
             end = start + 2.0 * math.pi * value / self.total
             self.context.set_source_rgba(
                 *utils.get_opposite_color(self.colors[name]))
-            w = self.context.text_extents(name)[2]
-            h = self.context.text_extents(name)[4]
+            extents = utils.get_text_extents(
+                self.context, name, self.text_cache)
+            w = extents[2]
+            h = extents[4]
             x = x0 + (self.radius - w) * math.cos(
                 (start + end) / 2.0) - w + self.line_width * 2
             y = y0 + (self.radius - h) * math.sin(
@@ -782,6 +1300,323 @@ class PieGraph():
             start = end
 
 
+tile_graph = None
+
+
+def init_tile_worker(state):
+    # Se ejecuta una vez en cada proceso de DotGraph.render_tiled
+    global tile_graph
+    tile_graph = DotGraph.__new__(DotGraph)
+    tile_graph.__dict__.update(state)
+
+
+def render_tile(tile):
+    # Dibuja una parte de tile_graph y devuelve sus píxeles en RGB
+    x, y, width, height = tile
+    surface = cairo.ImageSurface(cairo.FORMAT_RGB24, width, height)
+    tile_graph.context = cairo.Context(surface)
+    tile_graph.context.translate(-x, -y)
+    tile_graph.context.rectangle(x, y, width, height)
+    tile_graph.context.clip()
+
+    if tile_graph.data:
+        tile_graph.draw()
+    else:
+        tile_graph.render_background()
+
+    tile_graph.context = None
+    surface.flush()
+
+    return utils.surface_to_rgb(surface)
+
+
+class Dashboard():
+
+    def __init__(self, context=None, rows=1, columns=1,
+                 width=500, height=500):
+
+        """
+        context:
+            Un cairo context sobre el cual dibujar todas las gráficas.
+
+        rows, columns:
+            Enteros, la cantidad de filas y columnas de la grilla.
+
+        width, height:
+            Enteros o decimales, el tamaño total de la grilla.
+
+        Las gráficas agregadas comparten los colores, las medidas de los
+        textos y las etiquetas de los ejes. Las celdas que no cambiaron
+        desde el último render no se vuelven a dibujar, por lo que el
+        context debe conservar lo dibujado anteriormente (por ejemplo el de
+        un ImageSurface). Al cambiar de context se dibuja todo otra vez.
+
+        Se detectan los cambios en los datos, los colores y las opciones de
+        cada gráfica; para cualquier otro cambio (por ejemplo la fuente del
+        context) hay que llamar a invalidate, que también vacía las medidas
+        de los textos compartidas.
+        """
+
+        self.context = context
+        self.cells = {}
+        self.groups = {}
+        self.rendered = {}
+        self.colors = {}
+        self.text_cache = {}
+        self.labels_cache = {}
+        self.background = (1, 1, 1)
+        self.spacing = 0
+        self.set_rows(rows)
+        self.set_columns(columns)
+        self.set_width(width)
+        self.set_height(height)
+
+    def set_context(self, context):
+        """
+        context:
+            Un cairo context sobre el cual dibujar.
+        """
+
+        self.context = context
+        self.invalidate()
+
+    def get_context(self):
+        return self.context
+
+    def set_rows(self, rows):
+        """
+        rows:
+            Un entero, la cantidad de filas de la grilla
+        """
+
+        if type(rows) == int:
+            self.rows = rows
+            self.invalidate()
+        else:
+            raise TypeError('"rows" must be a int')
+
+    def get_rows(self):
+        return self.rows
+
+    def set_columns(self, columns):
+        """
+        columns:
+            Un entero, la cantidad de columnas de la grilla
+        """
+
+        if type(columns) == int:
+            self.columns = columns
+            self.invalidate()
+        else:
+            raise TypeError('"columns" must be a int')
+
+    def get_columns(self):
+        return self.columns
+
+    def set_width(self, width):
+        """
+        width:
+            Un entero o un decimal, el ancho total de la grilla.
+        """
+
+        if type(width) in [float, int]:
+            self.width = width
+            self.invalidate()
+        else:
+            raise TypeError('"width" must be a int or float')
+
+    def get_width(self):
+        return self.width
+
+    def set_height(self, height):
+        """
+        height:
+            Un entero o un decimal, el alto total de la grilla.
+        """
+
+        if type(height) in [float, int]:
+            self.height = height
+            self.invalidate()
+        else:
+            raise TypeError('"height" must be a int or float')
+
+    def get_height(self):
+        return self.height
+
+    def set_background(self, background):
+        """
+        background:
+            El color de fondo de la grilla, ver DotGraph.set_background
+        """
+
+        if type(background) in [list, tuple, str]:
+            self.background = utils.get_cairo_color(background)
+            self.invalidate()
+        else:
+            raise TypeError(
+                '"background" must be a list, a tuple, or a string')
+
+    def get_background(self):
+        return self.background
+
+    def set_spacing(self, spacing):
+        """
+        spacing:
+            Un entero o un decimal, el espacio entre las celdas
+        """
+
+        if type(spacing) in [int, float]:
+            self.spacing = spacing
+            self.invalidate()
+        else:
+            raise TypeError('"spacing" must be a int or float')
+
+    def get_spacing(self):
+        return self.spacing
+
+    def add_graph(self, graph, row, column, group=None):
+        """
+        graph:
+            Un DotGraph o un PieGraph.
+
+        row, column:
+            Enteros, la celda en donde se dibuja la gráfica.
+
+        group:
+            Cualquier valor, las DotGraph del mismo grupo comparten el rango
+            de los ejes, que se calcula una sola vez para todo el grupo.
+        """
+
+        if not isinstance(graph, (DotGraph, PieGraph)):
+            raise TypeError('"graph" must be a DotGraph or a PieGraph')
+
+        if row not in range(self.rows) or column not in range(self.columns):
+            raise ValueError('The cell (%d, %d) is outside the grid' % (
+                row, column))
+
+        for name, color in graph.colors.items():
+            if name not in self.colors:
+                self.colors[name] = color
+
+        previous = self.cells.get((row, column), None)
+        if previous is not None and previous is not graph:
+            self.remove_graph(row, column)
+
+        graph.colors = self.colors
+        graph.text_cache = self.text_cache
+        if isinstance(graph, DotGraph):
+            graph.labels_cache = self.labels_cache
+            if group is None:
+                # Pudo haber estado en un grupo, vuelve a usar sus datos
+                graph.set_range()
+
+        self.cells[(row, column)] = graph
+        self.groups[(row, column)] = group
+        self.rendered.pop((row, column), None)
+
+    def get_graph(self, row, column):
+        return self.cells.get((row, column), None)
+
+    def remove_graph(self, row, column):
+        graph = self.cells.pop((row, column), None)
+        self.groups.pop((row, column), None)
+        if isinstance(graph, DotGraph):
+            graph.set_range()
+
+        self.invalidate()
+
+    def invalidate(self):
+        # Olvidar lo dibujado y las medidas de los textos, en el próximo
+        # render se dibuja todo. Los caches se vacían sin reemplazarlos
+        # porque las gráficas usan los mismos diccionarios
+        self.rendered = {}
+        self.text_cache.clear()
+        self.labels_cache.clear()
+
+    def calculate_ranges(self):
+        ranges = {}
+
+        for cell, graph in self.cells.items():
+            group = self.groups[cell]
+            if group is None or not isinstance(graph, DotGraph) or \
+                    not graph.data:
+                continue
+
+            max_h_label, max_v_label = ranges.get(group, (0, 0))
+            for values in graph.data.values():
+                max_h_label = max(max_h_label, len(values))
+                max_v_label = max(max_v_label, utils.get_max(values))
+
+            ranges[group] = (max_h_label, max_v_label)
+
+        return ranges
+
+    def get_signature(self, graph):
+        # Una representación de los datos, los colores y las opciones de la
+        # gráfica (ver DotGraph.options), si no cambia no hace falta volver
+        # a dibujarla
+        if isinstance(graph, DotGraph):
+            data = tuple((name, tuple(values))
+                         for name, values in graph.data.items())
+        else:
+            data = tuple(graph.data.items())
+
+        colors = tuple(self.colors.get(name, None) for name in graph.data)
+        options = tuple(getattr(graph, name, None) for name in graph.options)
+
+        return data, colors, options
+
+    def render(self):
+        if not self.context:
+            return
+
+        if not self.rendered:
+            self.context.set_source_rgb(*self.background)
+            self.context.rectangle(0, 0, self.width, self.height)
+            self.context.fill()
+
+        # Fijar la versión actual de las series en memoria compartida, para
+        # que los rangos y las firmas no usen la del render anterior
+        for graph in self.cells.values():
+            if isinstance(graph, DotGraph):
+                graph.pin_data()
+
+        ranges = self.calculate_ranges()
+        cell_width = (self.width - self.spacing * (self.columns - 1)) / \
+            float(self.columns)
+        cell_height = (self.height - self.spacing * (self.rows - 1)) / \
+            float(self.rows)
+
+        for (row, column), graph in self.cells.items():
+            group_range = ranges.get(self.groups[(row, column)], None)
+            signature = (self.get_signature(graph), group_range)
+            if self.rendered.get((row, column), None) == signature:
+                continue
+
+            if group_range is not None:
+                graph.set_range(*group_range)
+
+            x = (cell_width + self.spacing) * column
+            y = (cell_height + self.spacing) * row
+
+            self.context.save()
+            self.context.translate(x, y)
+            self.context.rectangle(0, 0, cell_width, cell_height)
+            self.context.clip()
+
+            graph.set_context(self.context)
+            graph.set_width(cell_width)
+            graph.set_height(cell_height)
+            graph.render()
+
+            self.context.restore()
+
+            # Se calcula de nuevo porque el render asigna los colores que
+            # faltaban
+            self.rendered[(row, column)] = (self.get_signature(graph),
+                                            group_range)
+
+
 """
 import random
 from gi.repository import Gtk
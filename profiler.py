@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import gc
+import tracemalloc
+
+
+PHASES = ['calculate_things', 'render_background', 'render_frame',
+          'render_axes', 'render_graph', 'render_labels']
+
+
+class AllocationProfiler():
+
+    def __init__(self, graph, phases=None):
+
+        """
+        graph:
+            Un DotGraph o un PieGraph, con su context ya asignado.
+
+        phases:
+            Una lista con los nombres de los métodos de graph a medir, por
+            defecto los de PHASES que tenga graph.
+
+        Uso:
+            profiler = AllocationProfiler(graph)
+            profiler.run(frames=100)
+            print(profiler.report())
+
+        Cada fase se mide comparando dos snapshots de tracemalloc, así que
+        el render se vuelve mucho más lento mientras se mide.
+
+        De cada fase se guarda la memoria retenida, el pico de memoria
+        (que incluye los objetos temporales creados y liberados dentro de
+        la fase) y la cantidad de recolecciones del gc que provocó. Los
+        lugares del código (get_top_sites) solo se atribuyen por la memoria
+        retenida: tracemalloc no permite saber desde dónde se reservaron
+        los objetos temporales ya liberados, para eso hay que mirar el pico
+        y las recolecciones de la fase.
+        """
+
+        self.graph = graph
+        self.phases = [name for name in (phases or PHASES)
+                       if hasattr(graph, name)]
+        self.recording = False
+        self.frames = 0
+        self.totals = {}
+        self.sites = {}
+
+    def wrap(self, name):
+        method = getattr(self.graph, name)
+
+        def wrapper(*args, **kwargs):
+            if not self.recording:
+                return method(*args, **kwargs)
+
+            before = tracemalloc.take_snapshot()
+            collections = self.get_collections()
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+
+            try:
+                return method(*args, **kwargs)
+            finally:
+                peak = tracemalloc.get_traced_memory()[1] - start
+                collections = self.get_collections() - collections
+                after = tracemalloc.take_snapshot()
+                self.add_phase(name, before, after, peak, collections)
+
+        setattr(self.graph, name, wrapper)
+
+    def get_collections(self):
+        # Cantidad de recolecciones del gc, de todas las generaciones
+        return sum([stats['collections'] for stats in gc.get_stats()])
+
+    def add_phase(self, name, before, after, peak, collections):
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__),
+                   tracemalloc.Filter(False, __file__)]
+        before = before.filter_traces(filters)
+        after = after.filter_traces(filters)
+
+        net, total_peak, total_collections = self.totals.get(name, (0, 0, 0))
+        sites = self.sites.setdefault(name, {})
+
+        for stat in after.compare_to(before, 'lineno'):
+            net += stat.size_diff
+            if stat.size_diff > 0:
+                site = str(stat.traceback[0])
+                size, count = sites.get(site, (0, 0))
+                sites[site] = (size + stat.size_diff,
+                               count + stat.count_diff)
+
+        self.totals[name] = (net, total_peak + peak,
+                             total_collections + collections)
+
+    def run(self, frames=100, warmup=1):
+        """
+        Dibuja la gráfica warmup veces sin medir (para llenar los caches) y
+        luego frames veces midiendo cada fase.
+        """
+
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+
+        for name in self.phases:
+            self.wrap(name)
+
+        try:
+            for frame in range(warmup):
+                self.graph.render()
+
+            self.recording = True
+            for frame in range(frames):
+                self.graph.render()
+                self.frames += 1
+        finally:
+            self.recording = False
+            for name in self.phases:
+                delattr(self.graph, name)
+
+            if started:
+                tracemalloc.stop()
+
+    def get_results(self):
+        """
+        Devuelve un diccionario con los nombres de las fases como keys y
+        tuplas (bytes retenidos por frame, pico de bytes por frame,
+        recolecciones del gc por frame) como values.
+        """
+
+        frames = float(max(self.frames, 1))
+        return dict([(name, (net / frames, peak / frames,
+                             collections / frames))
+                     for name, (net, peak, collections)
+                     in self.totals.items()])
+
+    def get_top_sites(self, limit=10):
+        """
+        Devuelve una lista de tuplas (fase, archivo:línea, bytes por frame,
+        bloques por frame) con los lugares que más memoria retuvieron al
+        terminar cada fase.
+        """
+
+        frames = float(max(self.frames, 1))
+        sites = []
+        for name, phase_sites in self.sites.items():
+            for site, (size, count) in phase_sites.items():
+                sites.append((name, site, size / frames, count / frames))
+
+        sites.sort(key=lambda site: site[2], reverse=True)
+        return sites[:limit]
+
+    def report(self, limit=10):
+        lines = ['%d frames' % self.frames, '',
+                 '%-20s %16s %16s %10s' % ('phase', 'net B/frame',
+                                           'peak B/frame', 'GC/frame')]
+
+        results = self.get_results()
+        for name in self.phases:
+            if name in results:
+                net, peak, collections = results[name]
+                lines.append('%-20s %16.1f %16.1f %10.2f' % (
+                    name, net, peak, collections))
+
+        lines.extend(['', 'Top retaining sites:'])
+        for name, site, size, count in self.get_top_sites(limit):
+            lines.append('%10.1f B %8.1f blocks  %-18s %s' % (
+                size, count, name, site))
+
+        return '\n'.join(lines)
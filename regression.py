@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Pruebas de regresión de los renderers: dibuja un conjunto fijo de
+# gráficas y compara cada una con su imagen de referencia (golden/) y con la
+# cantidad máxima de operaciones de dibujo de cairo permitidas.
+#
+#     python regression.py            Comprobar todas las gráficas
+#     python regression.py --timing   Comprobar también el tiempo de render
+#     python regression.py --update   Regenerar las imágenes de referencia
+#
+# Las imágenes dependen de las fuentes instaladas, por eso se compara con
+# una tolerancia. Si falta la imagen de referencia de alguna gráfica la
+# prueba falla; las imágenes nuevas se generan con --update y se agregan al
+# repositorio después de revisarlas.
+#
+# El tiempo de render se mide en relación a calibrate(), un dibujo fijo que
+# no usa PyGraph, así que los límites valen en máquinas de distinta
+# velocidad.
+
+import os
+import sys
+import math
+import time
+import cairo
+
+from PyGraph import DotGraph, PieGraph
+
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'golden')
+
+# Diferencia máxima por canal para que dos píxeles se consideren iguales, y
+# proporción máxima de píxeles distintos
+PIXEL_TOLERANCE = 8
+MAX_DIFFERENT_PIXELS = 0.002
+
+# Los métodos de cairo.Context que cuentan como operaciones de dibujo
+OPERATIONS = ['move_to', 'line_to', 'curve_to', 'rel_move_to', 'rel_line_to',
+              'rel_curve_to', 'arc', 'arc_negative', 'rectangle',
+              'close_path', 'stroke', 'stroke_preserve', 'fill',
+              'fill_preserve', 'paint', 'paint_with_alpha', 'mask',
+              'mask_surface', 'show_text', 'show_glyphs', 'text_path']
+
+COLORS = {'sin': (0.8, 0.2, 0.2),
+          'cos': (0.2, 0.4, 0.8),
+          'ramp': (0.2, 0.6, 0.2)}
+
+# max_time se expresa en unidades de calibrate() y solo se comprueba con
+# --timing. Los límites son alrededor de 1.5 veces el tiempo medido, porque
+# la medida varía bastante de una ejecución a otra.
+SPECS = [
+    {'name': 'dot_small',
+     'graph': DotGraph,
+     'data': {'sin': [5 + 4 * math.sin(x / 2.0) for x in range(12)],
+              'cos': [5 + 4 * math.cos(x / 2.0) for x in range(12)]},
+     'options': {},
+     'max_operations': 180,
+     'max_time': 0.2},
+
+    {'name': 'dot_dense',
+     'graph': DotGraph,
+     'data': {'sin': [50 + 40 * math.sin(x / 40.0) for x in range(2000)],
+              'ramp': [x / 25.0 for x in range(2000)]},
+     'options': {'set_dots_radius': 1, 'set_graph_line_width': 1},
+     'max_operations': 22000,
+     'max_time': 9},
+
+    {'name': 'dot_simplified',
+     'graph': DotGraph,
+     'data': {'sin': [50 + 40 * math.sin(x / 40.0) for x in range(2000)],
+              'ramp': [x / 25.0 for x in range(2000)]},
+     'options': {'set_dots_radius': 1, 'set_graph_line_width': 1,
+                 'set_simplify_tolerance': 0.5},
+     'max_operations': 6600,
+     'max_time': 8},
+
+    {'name': 'dot_no_axes',
+     'graph': DotGraph,
+     'data': {'ramp': [x * 0.37 for x in range(30)]},
+     'options': {'set_draw_axes': False, 'set_draw_frame': False},
+     'max_operations': 165,
+     'max_time': 0.2},
+
+    {'name': 'pie',
+     'graph': PieGraph,
+     'data': {'sin': 30, 'cos': 50, 'ramp': 20},
+     'options': {'set_radius': 200},
+     'max_operations': 55,
+     'max_time': 0.2},
+]
+
+
+class CountingContext():
+
+    def __init__(self, context):
+        # Un cairo.Context que cuenta las operaciones de dibujo (trazados,
+        # rellenos y textos) que se le piden, sin contar las consultas
+        self.context = context
+        self.operations = 0
+
+    def __getattr__(self, name):
+        attribute = getattr(self.context, name)
+        if name not in OPERATIONS:
+            return attribute
+
+        def method(*args):
+            self.operations += 1
+            return attribute(*args)
+
+        return method
+
+
+def create_graph(spec, context):
+    graph = spec['graph'](context=context, data=dict(spec['data']),
+                          colors=dict(COLORS), width=500, height=500)
+    for setter, value in spec['options'].items():
+        getattr(graph, setter)(value)
+
+    return graph
+
+
+def get_best_time(function, repeat=5):
+    # El menor tiempo de repeat llamadas a function
+    best = None
+    for x in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def calibrate():
+    # Un dibujo fijo con 1000 segmentos y 1000 círculos, cada uno trazado
+    # por separado, que sirve de unidad para medir los tiempos de render
+    context = cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 500, 500))
+
+    def draw():
+        context.set_source_rgb(1, 1, 1)
+        context.paint()
+        context.set_source_rgb(0.2, 0.4, 0.8)
+        for x in range(1000):
+            y = 250 + 200 * math.sin(x / 50.0)
+            context.move_to(x / 2.0, y)
+            context.line_to(x / 2.0 + 0.5, y + 1)
+            context.stroke()
+            context.arc(x / 2.0, y, 2, 0, 2 * math.pi)
+            context.fill()
+
+    return get_best_time(draw)
+
+
+def render_spec(spec):
+    # Devuelve la imagen dibujada, la cantidad de operaciones de dibujo y
+    # el gráfico, ya dibujado una vez
+    surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, 500, 500)
+    context = CountingContext(cairo.Context(surface))
+    graph = create_graph(spec, context)
+    graph.render()
+    surface.flush()
+
+    return surface, context.operations, graph
+
+
+def get_render_time(graph):
+    # El menor tiempo de render, sin contar operaciones
+    graph.set_context(cairo.Context(
+        cairo.ImageSurface(cairo.FORMAT_ARGB32, 500, 500)))
+
+    return get_best_time(graph.render)
+
+
+def compare_surfaces(surface, golden):
+    # La proporción de píxeles que difieren más de PIXEL_TOLERANCE
+    if (surface.get_width(), surface.get_height()) != \
+            (golden.get_width(), golden.get_height()):
+        return 1.0
+
+    data = bytes(surface.get_data())
+    golden_data = bytes(golden.get_data())
+    if data == golden_data:
+        return 0.0
+
+    different = 0
+    for index in range(0, len(data), 4):
+        if data[index:index + 4] == golden_data[index:index + 4]:
+            continue
+
+        for channel in range(index, index + 4):
+            if abs(data[channel] - golden_data[channel]) > PIXEL_TOLERANCE:
+                different += 1
+                break
+
+    return different / float(surface.get_width() * surface.get_height())
+
+
+def check_spec(spec, update=False, calibration=None):
+    # Devuelve una lista con los problemas encontrados. Si se indica
+    # calibration (ver calibrate) se comprueba también el tiempo de render.
+    errors = []
+    surface, operations, graph = render_spec(spec)
+    filename = os.path.join(GOLDEN_DIR, spec['name'] + '.png')
+
+    if update:
+        if not os.path.isdir(GOLDEN_DIR):
+            os.makedirs(GOLDEN_DIR)
+
+        surface.write_to_png(filename)
+
+    elif not os.path.exists(filename):
+        errors.append('missing golden image %s, run with --update' %
+                      filename)
+
+    else:
+        golden = cairo.ImageSurface.create_from_png(filename)
+        different = compare_surfaces(surface, golden)
+        if different > MAX_DIFFERENT_PIXELS:
+            errors.append('%.2f%% of the pixels differ from %s' % (
+                different * 100, filename))
+
+    if operations > spec['max_operations']:
+        errors.append('%d cairo operations, the budget is %d' % (
+            operations, spec['max_operations']))
+
+    if calibration is not None:
+        ratio = get_render_time(graph) / calibration
+        if ratio > spec['max_time']:
+            errors.append('render took %.2f calibration units, the budget '
+                          'is %.2f' % (ratio, spec['max_time']))
+
+    return errors
+
+
+def main(args):
+    update = '--update' in args
+    calibration = calibrate() if '--timing' in args else None
+    failed = 0
+
+    for spec in SPECS:
+        errors = check_spec(spec, update, calibration)
+        print('%-16s %s' % (spec['name'], 'FAIL' if errors else 'ok'))
+        for error in errors:
+            print('    ' + error)
+
+        failed += 1 if errors else 0
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
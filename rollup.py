@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+
+
+class RollupLevel():
+
+    def __init__(self, resolution, retention):
+
+        """
+        resolution:
+            Un entero o un decimal, la cantidad de segundos que abarca cada
+            intervalo.
+
+        retention:
+            Un entero, la cantidad de intervalos que se conservan, los más
+            viejos se descartan.
+        """
+
+        self.resolution = resolution
+        self.retention = retention
+        self.mins = [0] * retention
+        self.maxs = [0] * retention
+        self.sums = [0] * retention
+        self.counts = [0] * retention
+        self.first = None
+        self.last = None
+
+    def covers(self, timestamp):
+        # Indica si el nivel todavía conserva el intervalo de timestamp (o
+        # alguno anterior)
+        return self.last is not None and \
+            self.first * self.resolution <= timestamp
+
+    def clear_bucket(self, bucket):
+        slot = bucket % self.retention
+        self.mins[slot] = 0
+        self.maxs[slot] = 0
+        self.sums[slot] = 0
+        self.counts[slot] = 0
+
+    def add(self, timestamp, value):
+        bucket = int(timestamp // self.resolution)
+
+        if self.last is None:
+            self.first = self.last = bucket
+            self.clear_bucket(bucket)
+
+        elif bucket > self.last:
+            # Limpiar los intervalos que se reutilizan
+            for old in range(max(self.last + 1, bucket - self.retention + 1),
+                             bucket + 1):
+                self.clear_bucket(old)
+
+            self.last = bucket
+            self.first = max(self.first, bucket - self.retention + 1)
+
+        elif bucket < self.first:
+            # Demasiado viejo para este nivel
+            return
+
+        slot = bucket % self.retention
+        if self.counts[slot]:
+            self.mins[slot] = min(self.mins[slot], value)
+            self.maxs[slot] = max(self.maxs[slot], value)
+        else:
+            self.mins[slot] = self.maxs[slot] = value
+
+        self.sums[slot] += value
+        self.counts[slot] += 1
+
+    def get_values(self, start, end, field='mean', group=1):
+        """
+        Devuelve una lista con un valor cada group intervalos entre start y
+        end. Los grupos empiezan en múltiplos de resolution * group, así
+        que dos niveles con el mismo tamaño de grupo dan valores alineados.
+        Los grupos sin datos valen None (0 con field='count'); si no hay
+        ningún dato se devuelve una lista vacía.
+        """
+
+        values = []
+        if self.last is None:
+            return values
+
+        size = self.resolution * group
+        found = False
+
+        for number in range(int(start // size), int(end // size) + 1):
+            count = 0
+            total = 0
+            low = high = None
+
+            for bucket in range(max(number * group, self.first),
+                                min((number + 1) * group - 1, self.last) + 1):
+                slot = bucket % self.retention
+                if not self.counts[slot]:
+                    continue
+
+                if count:
+                    low = min(low, self.mins[slot])
+                    high = max(high, self.maxs[slot])
+                else:
+                    low, high = self.mins[slot], self.maxs[slot]
+
+                count += self.counts[slot]
+                total += self.sums[slot]
+
+            if not count:
+                values.append(0 if field == 'count' else None)
+                continue
+
+            found = True
+            if field == 'mean':
+                value = total / float(count)
+            elif field == 'min':
+                value = low
+            elif field == 'max':
+                value = high
+            else:
+                value = count
+
+            values.append(value)
+
+        return values if found else []
+
+
+class Rollup():
+
+    def __init__(self, levels=((1, 3600), (60, 10080), (3600, 8760),
+                               (86400, 3650))):
+
+        """
+        levels:
+            Una lista de tuplas (resolución, retención), de la más fina a la
+            más gruesa. Por defecto: una hora de segundos, una semana de
+            minutos, un año de horas y diez años de días.
+
+        Cada valor agregado actualiza el mínimo, el máximo, la suma y la
+        cantidad de su intervalo en todos los niveles, así que consultar
+        cualquier rango cuesta lo mismo sin importar cuánta historia se
+        guarde.
+        """
+
+        self.levels = []
+        self.first_timestamp = None
+        for resolution, retention in levels:
+            if type(resolution) not in [int, float] or resolution <= 0:
+                raise ValueError('"resolution" must be a positive number')
+
+            if type(retention) != int or retention <= 0:
+                raise ValueError('"retention" must be a positive int')
+
+            self.levels.append(RollupLevel(resolution, retention))
+
+        if not self.levels:
+            raise ValueError('"levels" must not be empty')
+
+        self.levels.sort(key=lambda level: level.resolution)
+
+    def append(self, value, timestamp=None):
+        """
+        value:
+            Un entero o un decimal, el valor medido.
+
+        timestamp:
+            El momento de la medida en segundos (como time.time()), por
+            defecto el momento actual.
+        """
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        if self.first_timestamp is None or timestamp < self.first_timestamp:
+            self.first_timestamp = timestamp
+
+        for level in self.levels:
+            level.add(timestamp, value)
+
+    def get_level(self, start, end, points, resolution=None):
+        """
+        Devuelve el nivel más fino que entra en points valores entre start
+        y end (o el más grueso si ninguno entra) y que todavía conserva los
+        datos desde start. Si se indica resolution se elige entre los
+        niveles que no superan esa resolución, empezando por el más grueso.
+        Si ningún nivel conserva todo el rango se devuelve el que conserva
+        desde más atrás.
+        """
+
+        if resolution is not None:
+            levels = [level for level in self.levels
+                      if level.resolution <= resolution] or self.levels[:1]
+            levels.reverse()
+        else:
+            levels = [self.levels[-1]]
+            for index, level in enumerate(self.levels):
+                if int(end // level.resolution) - \
+                        int(start // level.resolution) + 1 <= points:
+                    levels = self.levels[index:]
+                    break
+
+        # Los niveles finos descartan antes los datos viejos; antes del
+        # primer valor agregado no hay nada que conservar
+        since = start
+        if self.first_timestamp is not None:
+            since = max(start, self.first_timestamp)
+
+        for level in levels:
+            if level.covers(since):
+                return level
+
+        kept = [level for level in levels if level.last is not None]
+        if not kept:
+            return levels[0]
+
+        return min(kept, key=lambda level: level.first * level.resolution)
+
+    def get_values(self, start, end, points, field='mean', resolution=None):
+        """
+        Devuelve como mucho points valores entre start y end, del nivel
+        más fino que conserve ese rango (ver get_level). Los intervalos sin
+        datos valen None (0 con field='count'); sin ningún dato en el rango
+        devuelve una lista vacía.
+
+        field:
+            'mean', 'min', 'max' o 'count'.
+
+        resolution:
+            Si se indica, los valores se agrupan en intervalos de esa
+            cantidad de segundos (o más, si no entran en points valores).
+            Sirve para que varias series usen los mismos intervalos.
+        """
+
+        if field not in ['mean', 'min', 'max', 'count']:
+            raise ValueError('"field" must be "mean", "min", "max" or "count"')
+
+        level = self.get_level(start, end, points, resolution)
+        group = 1
+        if resolution is not None:
+            group = max(int(round(resolution / float(level.resolution))), 1)
+
+        # Si ni el nivel más grueso entra en points valores se juntan
+        # varios intervalos en cada valor
+        while int(end // (level.resolution * group)) - \
+                int(start // (level.resolution * group)) + 1 > points:
+            group += 1
+
+        return level.get_values(start, end, field, group)
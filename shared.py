@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Series de datos en memoria compartida (multiprocessing.shared_memory),
+# para que otros procesos escriban los valores y DotGraph los lea sin
+# copiarlos ni serializarlos.
+#
+# El bloque tiene un encabezado (capacidad, escritura empezada, escritura
+# terminada y el largo de cada buffer) y dos buffers de decimales. Cada
+# escritura usa el buffer que no está publicado y al terminar lo publica,
+# así que quien lee siempre ve un buffer completo. Si el productor escribe
+# dos veces mientras se está dibujando, el buffer que se estaba leyendo pudo
+# cambiar a medias; is_torn lo detecta y DotGraph vuelve a dibujar.
+#
+# Los contadores del encabezado se leen y escriben como enteros de 8 bytes
+# alineados (un memoryview con formato 'Q'), así otro proceso nunca ve un
+# valor escrito a medias.
+#
+# Como cada escritura arma el buffer entero, append copia los valores que
+# se conservan: cuesta O(largo de la serie) y no O(valores agregados).
+#
+# Solo el proceso que crea el bloque es dueño de él (lo libera con unlink).
+# Los procesos independientes que se conectan por nombre lo quitan de su
+# resource_tracker, que si no lo borraría al terminar esos procesos. Los
+# procesos lanzados con multiprocessing usan el resource_tracker del padre y
+# no lo quitan, para no perder el registro del dueño; esto no se puede
+# detectar en los hijos de os.fork de un proceso que no creó el bloque.
+#
+# Prueba de estrés de is_torn, con un productor en otro proceso:
+#
+#     python shared.py [segundos]
+
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+import multiprocessing
+import sys
+import time
+import weakref
+
+
+HEADER_SIZE = 64
+ITEM_SIZE = 8
+
+# Los bloques creados por este proceso (o heredados con fork, que comparte
+# el resource_tracker), que no hay que quitar del resource_tracker
+created = set()
+
+# Los índices de los contadores en el encabezado
+CAPACITY = 0
+BEGIN = 1
+SEQUENCE = 2
+LENGTH = 3
+
+
+def release(views, memory):
+    # Liberar los memoryview sobre el bloque antes de cerrarlo, si no
+    # SharedMemory.close falla con BufferError
+    for view in views:
+        view.release()
+
+    del views[:]
+    memory.close()
+
+
+class SharedSeries():
+
+    def __init__(self, name=None, capacity=None):
+
+        """
+        name:
+            El nombre del bloque de memoria compartida. Para crear uno nuevo
+            puede ser None, y se usa un nombre al azar (ver self.name).
+
+        capacity:
+            Un entero, la cantidad máxima de valores. Si se indica se crea
+            un bloque nuevo, si no se usa el bloque ya creado con ese name.
+        """
+
+        if capacity is not None:
+            if type(capacity) != int or capacity <= 0:
+                raise ValueError('"capacity" must be a positive int')
+
+            self.memory = shared_memory.SharedMemory(
+                name, create=True,
+                size=HEADER_SIZE + 2 * capacity * ITEM_SIZE)
+            created.add(self.memory.name)
+        elif sys.version_info >= (3, 13):
+            self.memory = shared_memory.SharedMemory(name, track=False)
+        else:
+            self.memory = shared_memory.SharedMemory(name)
+            if self.memory.name not in created and \
+                    multiprocessing.parent_process() is None:
+                resource_tracker.unregister(self.memory._name,
+                                            'shared_memory')
+
+        self.header = self.memory.buf[:HEADER_SIZE].cast('Q')
+        if capacity is None:
+            capacity = self.header[CAPACITY]
+        else:
+            self.header[CAPACITY] = capacity
+
+        self.name = self.memory.name
+        self.capacity = capacity
+        self.buffers = []
+        for index in range(2):
+            start = HEADER_SIZE + index * capacity * ITEM_SIZE
+            self.buffers.append(self.memory.buf[
+                start:start + capacity * ITEM_SIZE].cast('d'))
+
+        self.pinned_sequence = None
+        self.pinned = None
+
+        # Todos los memoryview creados sobre el bloque, se liberan con
+        # close o cuando se pierde la serie sin cerrarla
+        self.views = [self.header] + self.buffers
+        self.finalizer = weakref.finalize(self, release, self.views,
+                                          self.memory)
+
+    def get_counter(self, index):
+        return self.header[index]
+
+    def set_counter(self, index, value):
+        self.header[index] = value
+
+    def publish(self, values, keep=0):
+        # Escribir en el buffer no publicado los últimos keep valores del
+        # buffer publicado seguidos de values, y publicarlo
+        sequence = self.get_counter(SEQUENCE)
+        current = sequence % 2
+        target = (sequence + 1) % 2
+        length = self.get_counter(LENGTH + current)
+        keep = min(keep, length)
+
+        self.set_counter(BEGIN, sequence + 1)
+        if keep:
+            self.buffers[target][:keep] = \
+                self.buffers[current][length - keep:length]
+        self.buffers[target][keep:keep + len(values)] = values
+        self.set_counter(LENGTH + target, keep + len(values))
+        self.set_counter(SEQUENCE, sequence + 1)
+
+    def write(self, values):
+        """
+        Reemplaza todos los valores de la serie (desde el proceso productor).
+        """
+
+        if len(values) > self.capacity:
+            raise ValueError('The series can hold at most %d values' %
+                             self.capacity)
+
+        self.publish(array('d', values))
+
+    def append(self, values):
+        """
+        Agrega values al final de la serie, descartando los primeros si se
+        supera la capacidad. Copia también los valores que se conservan,
+        así que cuesta lo mismo que write con la serie entera.
+        """
+
+        values = array('d', values[-self.capacity:])
+        self.publish(values, self.capacity - len(values))
+
+    def pin(self):
+        """
+        Fija la versión publicada de la serie, que es la que se lee hasta
+        el próximo pin. Devuelve un memoryview con los valores, sin copiar.
+        """
+
+        while True:
+            sequence = self.get_counter(SEQUENCE)
+            index = sequence % 2
+            length = self.get_counter(LENGTH + index)
+
+            if self.get_counter(BEGIN) < sequence + 2:
+                break
+
+        if self.pinned is not None:
+            self.views[:] = [view for view in self.views
+                             if view is not self.pinned]
+            self.pinned.release()
+
+        self.pinned_sequence = sequence
+        self.pinned = self.buffers[index][:length]
+        self.views.append(self.pinned)
+
+        return self.pinned
+
+    def is_torn(self):
+        """
+        Indica si el productor empezó a escribir sobre el buffer fijado por
+        pin, en ese caso lo leído desde el pin puede estar mezclado.
+        """
+
+        return self.pinned is not None and \
+            self.get_counter(BEGIN) >= self.pinned_sequence + 2
+
+    def get_values(self):
+        if self.pinned is None:
+            self.pin()
+
+        return self.pinned
+
+    def __len__(self):
+        return len(self.get_values())
+
+    def __getitem__(self, index):
+        return self.get_values()[index]
+
+    def __iter__(self):
+        return iter(self.get_values())
+
+    def close(self):
+        """
+        Deja de usar el bloque en este proceso.
+        """
+
+        self.finalizer()
+        self.pinned = None
+        self.header = None
+        self.buffers = []
+
+    def unlink(self):
+        """
+        Libera el bloque, debe llamarlo un solo proceso (normalmente el que
+        lo creó) cuando ya nadie lo usa.
+        """
+
+        self.memory.unlink()
+        created.discard(self.name)
+
+
+def produce(name, seconds):
+    # Escribir sin parar versiones de la serie con todos los valores
+    # iguales al número de versión
+    series = SharedSeries(name)
+    end = time.time() + seconds
+    version = 0
+    while time.time() < end:
+        version += 1
+        series.write(array('d', [version]) * series.capacity)
+
+    series.close()
+
+
+def check_torn_reads(seconds=5, capacity=20000):
+    """
+    Lee la serie mientras otro proceso la escribe y devuelve una tupla
+    (lecturas, lecturas descartadas por is_torn, lecturas mezcladas que
+    is_torn no detectó). Una lectura está mezclada si no todos los valores
+    son iguales; la última cantidad tiene que ser 0.
+    """
+
+    series = SharedSeries(capacity=capacity)
+    series.write(array('d', [0]) * capacity)
+    producer = multiprocessing.Process(target=produce,
+                                       args=(series.name, seconds))
+    producer.start()
+
+    reads = torn = missed = 0
+    try:
+        while producer.is_alive():
+            values = series.pin()
+            mixed = min(values) != max(values)
+
+            if series.is_torn():
+                torn += 1
+            elif mixed:
+                missed += 1
+
+            reads += 1
+    finally:
+        producer.join()
+        series.close()
+        series.unlink()
+
+    return reads, torn, missed
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+    reads, torn, missed = check_torn_reads(seconds)
+    print('%d reads, %d torn, %d mixed reads not detected' % (
+        reads, torn, missed))
+    sys.exit(1 if missed else 0)
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Envío de los frames de una gráfica a otros procesos, mandando solo las
+# partes que cambiaron desde el frame anterior.
+#
+# Cada frame empieza con FRAME_HEADER (b'PGFD', número de frame, formato de
+# cairo, ancho, alto, cantidad de partes) seguido de cada parte: TILE_HEADER
+# (x, y, ancho, alto, largo de los datos) y sus píxeles comprimidos con zlib,
+# 4 bytes por píxel tal como los guarda cairo en ese formato (ARGB32 o
+# RGB24, donde el cuarto byte no se usa).
+
+import sys
+import zlib
+import struct
+import cairo
+
+
+MAGIC = b'PGFD'
+FRAME_HEADER = struct.Struct('<4sIIIII')
+FORMATS = [cairo.FORMAT_ARGB32, cairo.FORMAT_RGB24]
+TILE_HEADER = struct.Struct('<IIIII')
+
+
+class FrameSender():
+
+    def __init__(self, output, tile_size=64, compression=1):
+
+        """
+        output:
+            Un objeto con un método write, por ejemplo un pipe o el
+            resultado de socket.makefile('wb').
+
+        tile_size:
+            Un entero, el tamaño de las partes en que se divide cada frame.
+
+        compression:
+            Un entero del 0 al 9, el nivel de compresión de zlib.
+        """
+
+        self.output = output
+        self.tile_size = tile_size
+        self.compression = compression
+        self.frame = 0
+        self.width = 0
+        self.height = 0
+        self.previous = None
+
+    def get_tiles(self, regions=None):
+        # Las partes (x, y, ancho, alto) que tocan alguna de las regiones
+        tiles = []
+        for y in range(0, self.height, self.tile_size):
+            for x in range(0, self.width, self.tile_size):
+                width = min(self.tile_size, self.width - x)
+                height = min(self.tile_size, self.height - y)
+
+                if regions is not None:
+                    for rx, ry, rw, rh in regions:
+                        if rx < x + width and x < rx + rw and \
+                                ry < y + height and y < ry + rh:
+                            break
+                    else:
+                        continue
+
+                tiles.append((x, y, width, height))
+
+        return tiles
+
+    def send(self, surface, regions=None):
+        """
+        Manda el contenido de surface (un cairo.ImageSurface ARGB32 o
+        RGB24) y devuelve la cantidad de partes que cambiaron.
+
+        regions:
+            Una lista de rectángulos (x, y, width, height), si se indica
+            solo se comparan las partes que los tocan, por ejemplo con
+            DotGraph.get_dirty_regions() (obtenidas antes del render).
+        """
+
+        format = surface.get_format()
+        if format not in FORMATS:
+            raise ValueError('Only ARGB32 and RGB24 surfaces can be sent')
+
+        surface.flush()
+        width, height = surface.get_width(), surface.get_height()
+        stride = surface.get_stride()
+        data = memoryview(surface.get_data())
+
+        if (width, height) != (self.width, self.height) or \
+                self.previous is None:
+            # Primer frame o cambió el tamaño, se manda todo
+            self.width, self.height = width, height
+            self.previous = bytearray(width * height * 4)
+            regions = None
+            force = True
+        else:
+            force = False
+
+        changed = []
+        for x, y, w, h in self.get_tiles(regions):
+            rows = []
+            different = force
+
+            for row in range(y, y + h):
+                start = row * stride + x * 4
+                pixels = data[start:start + w * 4]
+                rows.append(pixels)
+
+                if not different:
+                    previous = (row * width + x) * 4
+                    if self.previous[previous:previous + w * 4] != pixels:
+                        different = True
+
+            if different:
+                for row in range(h):
+                    previous = ((y + row) * width + x) * 4
+                    self.previous[previous:previous + w * 4] = rows[row]
+
+                changed.append(((x, y, w, h), zlib.compress(
+                    b''.join(rows), self.compression)))
+
+        message = [FRAME_HEADER.pack(MAGIC, self.frame, int(format), width,
+                                     height, len(changed))]
+        for (x, y, w, h), pixels in changed:
+            message.append(TILE_HEADER.pack(x, y, w, h, len(pixels)))
+            message.append(pixels)
+
+        self.output.write(b''.join(message))
+        self.output.flush()
+        self.frame += 1
+
+        return len(changed)
+
+
+class FrameReceiver():
+
+    def __init__(self, input):
+
+        """
+        input:
+            Un objeto con un método read, del otro lado de un FrameSender.
+        """
+
+        self.input = input
+        self.frame = None
+        self.format = cairo.FORMAT_ARGB32
+        self.width = 0
+        self.height = 0
+        self.data = bytearray()
+
+    def read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.input.read(size - len(data))
+            if not chunk:
+                raise EOFError('The stream was closed')
+
+            data += chunk
+
+        return data
+
+    def read_frame(self):
+        """
+        Lee el siguiente frame y devuelve la lista de partes
+        (x, y, width, height) que cambiaron.
+        """
+
+        magic, frame, format, width, height, count = FRAME_HEADER.unpack(
+            self.read(FRAME_HEADER.size))
+
+        if magic != MAGIC or format not in FORMATS:
+            raise ValueError('Invalid frame header')
+
+        if (width, height) != (self.width, self.height):
+            self.width, self.height = width, height
+            self.data = bytearray(width * height * 4)
+
+        tiles = []
+        for index in range(count):
+            x, y, w, h, size = TILE_HEADER.unpack(
+                self.read(TILE_HEADER.size))
+            pixels = zlib.decompress(self.read(size))
+
+            for row in range(h):
+                start = ((y + row) * width + x) * 4
+                self.data[start:start + w * 4] = \
+                    pixels[row * w * 4:(row + 1) * w * 4]
+
+            tiles.append((x, y, w, h))
+
+        self.frame = frame
+        self.format = FORMATS[FORMATS.index(format)]
+        return tiles
+
+    def get_surface(self):
+        # Un cairo.ImageSurface que usa directamente los píxeles recibidos,
+        # en el formato del último frame
+        return cairo.ImageSurface.create_for_data(
+            self.data, self.format, self.width, self.height,
+            self.width * 4)
+
+
+if __name__ == '__main__':
+    # Receptor de referencia: lee los frames de la entrada estándar y
+    # guarda el último en el archivo indicado
+    #
+    #     python productor.py | python stream.py frame.png
+    receiver = FrameReceiver(sys.stdin.buffer)
+    try:
+        while True:
+            receiver.read_frame()
+            receiver.get_surface().write_to_png(sys.argv[1])
+    except EOFError:
+        pass
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import sys
+import math
+import zlib
+import struct
 import random
 
 
@@ -47,4 +51,196 @@ def get_opposite_color(color):
     if color != (0.5, 0.5, 0.5):
         return (1.0 - color[0], 1.0 - color[1], 1.0 - color[2])
     else:
-        return (1.0, 1.0, 1.0)
\ No newline at end of file
+        return (1.0, 1.0, 1.0)
+
+
+def get_max(values, default=0):
+    # El mayor valor de values sin contar los None (los intervalos sin
+    # datos), o default si no hay ninguno
+    return max([value for value in values if value is not None] or [default])
+
+
+def get_font_key(context):
+    # La fuente actual de context (familia, estilo, grosor y tamaño), para
+    # usar en las keys de los caches de medidas. De las fuentes que no son
+    # cairo.ToyFontFace solo se conoce el tamaño.
+    face = context.get_font_face()
+    if hasattr(face, 'get_family'):
+        face = (face.get_family(), int(face.get_slant()),
+                int(face.get_weight()))
+    else:
+        face = None
+
+    return face, context.get_font_matrix().xx
+
+
+def get_text_extents(context, text, cache=None):
+    # Medir un texto con la fuente actual de context, guardando el
+    # resultado en cache (un diccionario que se puede compartir entre
+    # varias gráficas) para no volver a medirlo.
+    if cache is None:
+        return context.text_extents(text)
+
+    key = (get_font_key(context), text)
+    if key not in cache:
+        cache[key] = context.text_extents(text)
+
+    return cache[key]
+
+
+def get_nice_number(value, round_number):
+    # El número "redondo" (1, 2 o 5 por una potencia de 10) más cercano a
+    # value, redondeando o hacia arriba
+    exponent = math.floor(math.log10(value))
+    fraction = value / 10.0 ** exponent
+
+    if round_number:
+        if fraction < 1.5:
+            nice = 1
+        elif fraction < 3:
+            nice = 2
+        elif fraction < 7:
+            nice = 5
+        else:
+            nice = 10
+    else:
+        if fraction <= 1:
+            nice = 1
+        elif fraction <= 2:
+            nice = 2
+        elif fraction <= 5:
+            nice = 5
+        else:
+            nice = 10
+
+    return nice * 10.0 ** exponent
+
+
+def get_nice_ticks(maximum, marks, integer=False):
+    # Calcular unas marcas redondas para un eje que va de 0 a maximum, con
+    # aproximadamente marks marcas. Devuelve los valores de las marcas (el
+    # último es mayor o igual a maximum) y la cantidad de decimales
+    # necesarios para mostrarlos.
+    if maximum <= 0:
+        maximum = 1
+
+    step = get_nice_number(get_nice_number(maximum, False) / marks, True)
+    if integer:
+        step = max(step, 1)
+
+    precision = max(0, -int(math.floor(math.log10(step))))
+    count = int(math.ceil(maximum / step - 1e-9))
+    values = [round(step * x, precision) for x in range(1, count + 1)]
+
+    return values, precision
+
+
+def format_number(value, precision):
+    # Convertir value a texto con precision decimales
+    return '%.*f' % (precision, value)
+
+
+def simplify_path(points, tolerance):
+    # Simplificar una lista de puntos (x, y) con Douglas-Peucker, descartando
+    # los puntos que se desvían menos de "tolerance" de la recta que une a
+    # sus vecinos conservados. Los extremos siempre se conservan.
+    if tolerance <= 0 or len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    tolerance2 = tolerance * tolerance
+
+    while stack:
+        first, last = stack.pop()
+        x0, y0 = points[first]
+        x1, y1 = points[last]
+        dx, dy = x1 - x0, y1 - y0
+        length2 = dx * dx + dy * dy
+        max_distance2 = 0
+        index = first
+
+        for i in range(first + 1, last):
+            x, y = points[i]
+            if length2 == 0:
+                distance2 = (x - x0) ** 2 + (y - y0) ** 2
+            else:
+                distance2 = (dy * x - dx * y + x1 * y0 - y1 * x0) ** 2 / \
+                    length2
+
+            if distance2 > max_distance2:
+                max_distance2 = distance2
+                index = i
+
+        if max_distance2 > tolerance2:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def visible_dots(points, distance):
+    # Descartar los puntos que están a menos de "distance" de otro punto ya
+    # conservado, ya que sus marcadores se dibujarían prácticamente uno
+    # encima del otro. Se usa una grilla de celdas de tamaño distance y se
+    # revisan las 9 celdas vecinas de cada punto.
+    if distance <= 0:
+        return list(points)
+
+    distance2 = distance * distance
+    cells = {}
+    visible = []
+
+    for x, y in points:
+        column, row = int(x // distance), int(y // distance)
+        hidden = False
+
+        for cell in [(column + i, row + j)
+                     for i in (-1, 0, 1) for j in (-1, 0, 1)]:
+            for kx, ky in cells.get(cell, ()):
+                if (x - kx) ** 2 + (y - ky) ** 2 < distance2:
+                    hidden = True
+                    break
+
+            if hidden:
+                break
+
+        if not hidden:
+            cells.setdefault((column, row), []).append((x, y))
+            visible.append((x, y))
+
+    return visible
+
+
+def surface_to_rgb(surface):
+    # Convertir los píxeles de un cairo.ImageSurface (FORMAT_RGB24 o
+    # FORMAT_ARGB32 opaco, enteros de 32 bits en el orden de bytes de la
+    # máquina) a bytes RGB sin padding
+    width = surface.get_width()
+    height = surface.get_height()
+    stride = surface.get_stride()
+    data = bytes(surface.get_data())
+
+    if stride != width * 4:
+        data = b''.join(data[row * stride:row * stride + width * 4]
+                        for row in range(height))
+
+    if sys.byteorder == 'little':
+        red, green, blue = 2, 1, 0
+    else:
+        red, green, blue = 1, 2, 3
+
+    rgb = bytearray(width * height * 3)
+    rgb[0::3] = data[red::4]
+    rgb[1::3] = data[green::4]
+    rgb[2::3] = data[blue::4]
+
+    return bytes(rgb)
+
+
+def png_chunk(kind, data):
+    # Un chunk de un archivo PNG: largo, tipo, datos y CRC
+    return struct.pack('>I', len(data)) + kind + data + \
+        struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)